@@ -0,0 +1,12 @@
+#!/bin/sh
+# 用PyPy运行替换脚本
+# 脚本是纯Python的正则/循环负载，PyPy的JIT通常可提速数倍
+# 需要PyPy 7.3以上（兼容Python 3）；未安装时退回CPython运行
+cd "$(dirname "$0")" || exit 1
+
+if command -v pypy3 >/dev/null 2>&1; then
+    exec pypy3 replace_chinese.py "$@"
+fi
+
+echo "未找到pypy3，改用python3运行" >&2
+exec python3 replace_chinese.py "$@"
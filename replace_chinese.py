@@ -8,16 +8,39 @@
 """
 
 import re
+import io
+import os
+import mmap
 import random
+import pickle
+from collections import defaultdict
+from itertools import count
+from multiprocessing import Pool
 from pathlib import Path
 
 
 # 排除的汉字列表
-EXCLUDED_CHARS = set('序跋目录第章一二三四五六七八九十廿卅版权页占位')
+EXCLUDED_CHARS = frozenset('序跋目录第章一二三四五六七八九十廿卅版权页占位')
 
-# 生成简体字字符列表（使用GB2312字符集）
+# 匹配单个汉字（Unicode范围\u4e00-\u9fff）
+CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+# 匹配未转义的%注释（前面不是反斜杠），直到行尾
+COMMENT_RE = re.compile(r'(?<!\\)%[^\n]*')
+
+# 匹配受保护命令的方括号：
+# 组1：只保护第一个方括号的命令的方括号内容
+# 组2、组3：\firstfootnote的第一、二个方括号内容（第二个可选）
+PROTECTED_RE = re.compile(
+    r'\\(?:startbuffer|tofirstfootnote|sameasfootnote|basefootnote)'
+    r'\[([^\]\n]+)\]'
+    r'|\\firstfootnote\[([^\]\n]+)\](?:\[([^\]\n]+)\])?'
+)
+
+
+# 生成简体字字符池（使用GB2312字符集）
 def get_chinese_chars():
-    """生成所有可用的简体字字符列表（基于GB2312字符集）"""
+    """生成所有可用的简体字字符池（基于GB2312字符集，拼成单个字符串）"""
     chars = []
     # 使用GB2312编码来验证简体字
     # GB2312编码范围：0xA1A1-0xFEFE
@@ -33,190 +56,129 @@ def get_chinese_chars():
             except (UnicodeDecodeError, ValueError, LookupError):
                 # 跳过无效的GB2312编码或编码不支持的情况
                 continue
+    # 拼成单个字符串：按整数下标取字符比列表取元素开销更低
+    return ''.join(chars)
+
+
+# 汉字列表缓存文件（放在脚本旁边，首次运行时生成）
+CHARS_CACHE_FILE = Path(__file__).with_suffix('.chars.pkl')
+
+
+def load_chinese_chars():
+    """加载汉字池，优先读取缓存
+
+    GB2312全表扫描要做近万次try/except解码，缓存结果后
+    再次运行只需一次反序列化。缓存损坏或目录不可写时退回现场生成。
+    缓存中同时记录生成时的排除字符集：字符池是按EXCLUDED_CHARS
+    过滤出来的，修改排除列表后旧缓存自动失效并重新生成。
+    """
+    if CHARS_CACHE_FILE.exists():
+        try:
+            cached = pickle.loads(CHARS_CACHE_FILE.read_bytes())
+            # 缓存内容是(排除字符集, 字符池)，排除集或格式不符时重新生成
+            if (isinstance(cached, tuple) and len(cached) == 2
+                    and cached[0] == EXCLUDED_CHARS
+                    and isinstance(cached[1], str)):
+                return cached[1]
+        except (pickle.UnpicklingError, EOFError, OSError):
+            pass
+    chars = get_chinese_chars()
+    try:
+        CHARS_CACHE_FILE.write_bytes(pickle.dumps((EXCLUDED_CHARS, chars)))
+    except OSError:
+        # 缓存写不进去不影响功能，下次再重新生成
+        pass
     return chars
 
 
-# 预生成汉字列表
-CHINESE_CHARS = get_chinese_chars()
+# 预生成汉字池
+CHINESE_POOL = load_chinese_chars()
+
 
+def build_translate_table(text, rng):
+    """为一篇文档构建汉字替换表，供str.translate使用
 
-def replace_chinese_in_text(text):
+    每个不同的汉字只抽取一次随机替换字：相同的输入字全文映射为
+    相同的输出字，随机抽取次数从汉字总次数降到不同汉字数。
+    不在表中的字符（排除列表和非汉字）原样通过。
+    """
+    # 排序后再配对：集合的迭代顺序受哈希随机化影响，
+    # 排序保证同一份文本配同一个种子时产出确定的替换表
+    distinct_chars = sorted({
+        match.group(0) for match in CJK_RE.finditer(text)
+        if match.group(0) not in EXCLUDED_CHARS
+    })
+    replacements = rng.choices(CHINESE_POOL, k=len(distinct_chars))
+    return {
+        ord(char): ord(replacement)
+        for char, replacement in zip(distinct_chars, replacements)
+    }
+
+
+def replace_chinese_in_text(text, rng=None):
     """
     替换文本中的汉字为随机汉字
     不替换排除列表中的字符和其他非汉字字符
     不替换%注释符号后面的内容
     不替换特定命令的第一个方括号中的内容（这些内容会被替换为唯一数字ID）
+    rng为本次调用使用的随机数生成器，默认新建一个独立实例
     """
-    # 维护字符串到ID的映射（相同字符串使用相同ID）
-    string_to_id = {}
-    next_id = 1
-
-    def get_string_id(protected_string):
-        """获取字符串对应的ID，如果不存在则分配新ID"""
-        nonlocal next_id
-        if protected_string not in string_to_id:
-            string_to_id[protected_string] = next_id
-            next_id += 1
-        return string_to_id[protected_string]
-    def replace_char(match):
-        char = match.group(0)
-        # 如果字符在排除列表中，不替换
-        if char in EXCLUDED_CHARS:
-            return char
-        # 否则替换为随机汉字
-        return random.choice(CHINESE_CHARS)
-
-    # 匹配所有汉字（Unicode范围 \u4e00-\u9fff）
-    pattern = r'[\u4e00-\u9fff]'
-
-    # 需要保护第一个方括号的命令列表（直接使用正则表达式模式）
-    # 在正则表达式中，\\匹配字面的反斜杠
-    # 在Python原始字符串中，r'\\'表示一个字面的反斜杠
-    # 所以r'\\startbuffer'在正则中就是\\startbuffer，会匹配字面的\startbuffer
-    protected_commands = [
-        r'\\startbuffer',      # 正则模式：匹配 \startbuffer
-        r'\\firstfootnote',    # 正则模式：匹配 \firstfootnote
-        r'\\tofirstfootnote',  # 正则模式：匹配 \tofirstfootnote
-        r'\\sameasfootnote',   # 正则模式：匹配 \sameasfootnote
-        r'\\basefootnote'      # 正则模式：匹配 \basefootnote
-    ]
-
-    # 按行处理，保留%注释后的内容
-    lines = text.split('\n')
-    processed_lines = []
-
-    for line in lines:
-        # 查找%的位置（需要考虑转义的\%）
-        comment_pos = -1
-        for i, char in enumerate(line):
-            if char == '%' and (i == 0 or line[i-1] != '\\'):
-                comment_pos = i
-                break
-
-        # 确定需要处理的部分（%之前的内容）
-        if comment_pos >= 0:
-            text_to_process = line[:comment_pos]
-            comment_part = line[comment_pos:]
-        else:
-            text_to_process = line
-            comment_part = ''
-
-        # 保护特定命令的方括号内容
-        # 使用占位符标记受保护的区域
-        protected_regions = []
-        # 使用特殊Unicode字符作为占位符前缀，确保不会与文本内容冲突
-        placeholder_template = '\uE000PROTECTED{}\uE001'
-        placeholder_counter = 0
-
-        for cmd_pattern_base in protected_commands:
-            # 对于\firstfootnote，需要特殊处理：可能保护1个或2个方括号
-            if cmd_pattern_base == r'\\firstfootnote':
-                # 匹配\firstfootnote[xxx][xxx][...]形式（保护前两个方括号）
-                pattern_two = cmd_pattern_base + r'\[([^\]]+)\]\[([^\]]+)\]'
-                matches_two = list(re.finditer(pattern_two, text_to_process))
-
-                # 匹配\firstfootnote[xxx][...]形式（只保护第一个方括号）
-                pattern_one = cmd_pattern_base + r'\[([^\]]+)\]'
-                matches_one = list(re.finditer(pattern_one, text_to_process))
-
-                # 处理两个方括号的情况（从后往前处理，避免位置偏移）
-                for match in reversed(matches_two):
-                    # 获取两个方括号中的内容
-                    bracket1_content = match.group(1)  # 第一个方括号
-                    bracket2_content = match.group(2)  # 第二个方括号
-                    bracket1_start = match.start(1)
-                    bracket1_end = match.end(1)
-                    bracket2_start = match.start(2)
-                    bracket2_end = match.end(2)
-
-                    # 获取字符串对应的ID
-                    id1 = get_string_id(bracket1_content)
-                    id2 = get_string_id(bracket2_content)
-
-                    # 创建占位符
-                    placeholder1 = placeholder_template.format(placeholder_counter)
-                    placeholder_counter += 1
-                    placeholder2 = placeholder_template.format(placeholder_counter)
-                    placeholder_counter += 1
-
-                    # 记录占位符和对应的ID（而不是原始内容）
-                    protected_regions.append((placeholder1, str(id1)))
-                    protected_regions.append((placeholder2, str(id2)))
-
-                    # 从后往前替换：先替换第二个方括号，再替换第一个
-                    # 因为第二个在第一个之后，替换第二个不会影响第一个的位置
-                    text_to_process = (text_to_process[:bracket2_start] +
-                                      placeholder2 +
-                                      text_to_process[bracket2_end:])
-                    # 第一个方括号的位置不变（因为第二个在它后面，替换第二个不影响第一个）
-                    text_to_process = (text_to_process[:bracket1_start] +
-                                      placeholder1 +
-                                      text_to_process[bracket1_end:])
-
-                # 记录已处理的匹配位置，避免重复处理
-                processed_positions = {match_two.start(0) for match_two in matches_two}
-
-                # 处理只有一个方括号的情况（排除已经被两个方括号匹配的情况）
-                for match in reversed(matches_one):
-                    # 检查这个匹配是否已经被两个方括号的情况处理过
-                    if match.start(0) not in processed_positions:
-                        # 获取第一个方括号中的内容
-                        bracket_content = match.group(1)
-                        bracket_start = match.start(1)
-                        bracket_end = match.end(1)
-
-                        # 获取字符串对应的ID
-                        string_id = get_string_id(bracket_content)
-
-                        # 创建占位符
-                        placeholder = placeholder_template.format(placeholder_counter)
-                        placeholder_counter += 1
-
-                        # 记录占位符和对应的ID（而不是原始内容）
-                        protected_regions.append((placeholder, str(string_id)))
-
-                        # 替换方括号中的内容为占位符
-                        text_to_process = (text_to_process[:bracket_start] +
-                                          placeholder +
-                                          text_to_process[bracket_end:])
-            else:
-                # 其他命令：只保护第一个方括号
-                cmd_pattern = cmd_pattern_base + r'\[([^\]]+)\]'
-                matches = list(re.finditer(cmd_pattern, text_to_process))
-
-                for match in reversed(matches):  # 从后往前处理，避免位置偏移
-                    # 获取第一个方括号中的内容
-                    bracket_content = match.group(1)  # 例如：xxx
-                    bracket_start = match.start(1)  # 方括号内容的起始位置
-                    bracket_end = match.end(1)  # 方括号内容的结束位置
-
-                    # 获取字符串对应的ID
-                    string_id = get_string_id(bracket_content)
-
-                    # 创建占位符
-                    placeholder = placeholder_template.format(placeholder_counter)
-                    placeholder_counter += 1
-
-                    # 记录占位符和对应的ID（而不是原始内容）
-                    protected_regions.append((placeholder, str(string_id)))
+    # 每次调用使用独立的随机数生成器：新实例自动从系统熵播种，
+    # 多进程并发时互不共享状态，也不会产生相同的随机序列
+    if rng is None:
+        rng = random.Random()
 
-                    # 只替换方括号中的内容为占位符
-                    text_to_process = (text_to_process[:bracket_start] +
-                                      placeholder +
-                                      text_to_process[bracket_end:])
+    # 整篇文档共用一张替换表，汉字替换由str.translate在C层完成
+    # （注释中的汉字虽然也在表中，但注释区段不做translate，不受影响）
+    translate_map = build_translate_table(text, rng)
 
-        # 对处理后的文本进行汉字替换
-        processed_text = re.sub(pattern, replace_char, text_to_process)
-
-        # 恢复受保护的区域（按相反顺序恢复，使用精确替换）
-        for placeholder, original in reversed(protected_regions):
-            # 使用精确替换，确保只替换占位符
-            processed_text = processed_text.replace(placeholder, original, 1)
-
-        # 组合结果
-        processed_lines.append(processed_text + comment_part)
-
-    return '\n'.join(processed_lines)
+    # 维护字符串到ID的映射（相同字符串使用相同ID）
+    # defaultdict在首次访问时自动分配下一个ID，一次查找完成取值或分配
+    next_id = count(1)
+    string_to_id = defaultdict(lambda: next(next_id))
+
+    def handle_match(match):
+        """受保护命令的处理：方括号内容换成ID"""
+        matched = match.group(0)
+        if match.group(1) is not None:
+            # 只保护第一个方括号的命令：命令名保持不变，内容换成ID
+            command_head = matched[:matched.index('[') + 1]
+            return command_head + str(string_to_id[match.group(1)]) + ']'
+        # \firstfootnote：保护第一个方括号，第二个方括号存在时一并保护
+        result = '\\firstfootnote[' + str(string_to_id[match.group(2)]) + ']'
+        if match.group(3) is not None:
+            result += '[' + str(string_to_id[match.group(3)]) + ']'
+        return result
+
+    # 结果统一写入StringIO缓冲：内部缓冲按需倍增，
+    # 避免先攒片段列表、最后join再复制一遍的双份分配
+    # 热路径上把频繁调用的绑定方法提成局部名，省去每次的属性查找
+    buffer = io.StringIO()
+    buffer_write = buffer.write
+    protected_finditer = PROTECTED_RE.finditer
+
+    def process_segment(segment):
+        """处理一个非注释区段（可能跨多行），结果写入buffer
+
+        受保护命令之间的文本整段交给str.translate做汉字替换，
+        字符级循环全部发生在C层。
+        """
+        last_end = 0
+        for match in protected_finditer(segment):
+            buffer_write(segment[last_end:match.start()].translate(translate_map))
+            buffer_write(handle_match(match))
+            last_end = match.end()
+        buffer_write(segment[last_end:].translate(translate_map))
+
+    # 整篇文本一趟扫描：注释区段原样保留，注释之间的区段统一处理
+    pos = 0
+    for comment_match in COMMENT_RE.finditer(text):
+        process_segment(text[pos:comment_match.start()])
+        buffer_write(comment_match.group(0))
+        pos = comment_match.end()
+    process_segment(text[pos:])
+
+    return buffer.getvalue()
 
 
 def process_tex_file(file_path):
@@ -224,16 +186,29 @@ def process_tex_file(file_path):
     处理单个tex文件
     """
     try:
-        # 读取文件（使用utf-8编码）
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        # 通过mmap读取（使用utf-8编码）：直接使用内核页缓存，
+        # 避免普通read()在Python侧多出的一份读缓冲
+        file_path = Path(file_path)
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                content = ''
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    content = mm[:].decode('utf-8')
+
+        # 文件中没有汉字时无需改写，省去整个替换和写回
+        if not CJK_RE.search(content):
+            print(f"跳过（无汉字）: {file_path}")
+            return True
 
-        # 替换汉字
-        new_content = replace_chinese_in_text(content)
+        # 替换汉字（每个文件使用独立播种的随机数生成器）
+        new_content = replace_chinese_in_text(content, random.Random())
 
-        # 写回文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
+        # 写回文件：先写临时文件再原子改名，中途出错不会损坏原文件
+        tmp_path = file_path.with_suffix(file_path.suffix + '.tmp')
+        tmp_path.write_text(new_content, encoding='utf-8')
+        os.replace(tmp_path, file_path)
 
         print(f"已处理: {file_path}")
         return True
@@ -260,11 +235,10 @@ def main():
     print("开始处理...")
     print("-" * 50)
 
-    # 处理每个文件
-    success_count = 0
-    for tex_file in tex_files:
-        if process_tex_file(tex_file):
-            success_count += 1
+    # 并行处理每个文件（各文件相互独立，按CPU核数并发）
+    with Pool() as pool:
+        results = pool.map(process_tex_file, tex_files)
+    success_count = sum(results)
 
     print("-" * 50)
     print(f"处理完成！成功处理 {success_count}/{len(tex_files)} 个文件")